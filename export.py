@@ -5,20 +5,69 @@ import os
 import hashlib
 import uuid
 from datetime import datetime, timezone, timedelta, UTC
-from typing import Optional
+from typing import ClassVar, Optional
 from sqlmodel import SQLModel, Field, create_engine, Session, select
+from sqlalchemy import event, func, insert
+from sqlalchemy.orm import aliased
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from pydantic import model_validator
 from locationsharinglib import Service
 import argparse
-from urllib.parse import quote
+from urllib.parse import quote, urlencode
+from functools import cached_property, lru_cache
 import requests
-from itertools import combinations
-from geopy.distance import geodesic
-from collections import defaultdict
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+import numpy as np
+from collections import defaultdict, namedtuple
 from zoneinfo import ZoneInfo
 
+import sched
 import threading
 import time
+from contextlib import nullcontext
+
+# libyaml-Parser nutzen, falls PyYAML damit gebaut wurde
+try:
+    from yaml import CSafeLoader as _YamlLoader
+except ImportError:
+    from yaml import SafeLoader as _YamlLoader
+
+# Bereits eingerichtete Engines je Datenbankpfad
+_ENGINES = {}
+
+# Schlanke Position für die paarweise Abstandsberechnung (ts als POSIX-Zeitstempel)
+_Location = namedtuple("_Location", "id lat lon ts")
+
+# Trennzeichen zwischen den Feldern im Personen-Hash
+_HASH_SEPARATOR = b'|'
+
+# Mittlerer Erdradius für die Haversine-Formel
+EARTH_RADIUS_M = 6371000
+
+
+@lru_cache(maxsize=8)
+def _load_yaml(path: str, mtime_ns: int):
+    """Geparste YAML-Datei; mtime_ns ist Teil des Cache-Schlüssels."""
+    with open(path, 'r') as file:
+        return yaml.load(file, Loader=_YamlLoader)
+
+
+@lru_cache(maxsize=None)
+def _quote_name(name: str) -> str:
+    return quote(name)
+
+
+def _normalize_timestamp(raw_ts):
+    """Millisekunden-Timestamp in ein UTC-datetime umwandeln; Strings bleiben unverändert."""
+    if raw_ts is None or isinstance(raw_ts, str):
+        return raw_ts
+    try:
+        return datetime.fromtimestamp(float(raw_ts)/1000, tz=timezone.utc)
+    except (ValueError, TypeError):
+        return None  # fallback wenn ungültig
 
 
 class PersonModel(SQLModel, table=True):
@@ -29,40 +78,73 @@ class PersonModel(SQLModel, table=True):
     latitude: float
     longitude: float
     timestamp: Optional[str] = None
-    datetime: Optional[str] = None
+    datetime: Optional[str] = Field(default=None, index=True)
     accuracy: Optional[float] = None
     address: Optional[str] = None
     country_code: Optional[str] = None
     charging: Optional[bool] = None
     battery_level: Optional[int] = None
 
-    def __init__(self, **data):
-        # Timestamp umwandeln, falls nötig
-        raw_ts = data.get("timestamp")
-        if raw_ts is not None and not isinstance(raw_ts, str):
-            try:
-                data["datetime"] = datetime.fromtimestamp(float(raw_ts)/1000, tz=timezone.utc)#.isoformat()
-            except (ValueError, TypeError):
-                data["datetime"] = None  # fallback wenn ungültig
+    # Felder, aus denen die ID berechnet wird (Reihenfolge bestimmt den Hash)
+    _HASH_FIELDS: ClassVar[tuple] = (
+        "full_name", "nickname", "latitude", "longitude",
+        "timestamp", "accuracy", "address", "country_code",
+        "charging", "battery_level",
+    )
 
+    def __init__(self, **data):
         super().__init__(**data)
 
         # ID aus Hash berechnen, falls nicht gesetzt
         if not self.id:
             self.id = self.compute_hash()
-            
+
+    @classmethod
+    def from_person_gpx(cls, data: dict) -> "PersonModel":
+        return cls(**cls.row_from_person_gpx(data))
+
+    @classmethod
+    def row_from_person_gpx(cls, data: dict) -> dict:
+        """Spaltenwerte inkl. ID direkt aus dem __dict__ einer locationsharinglib-Person."""
+        row = {
+            "full_name": data['_full_name'],
+            "nickname": data['_nickname'],
+            "latitude": data['_latitude'],
+            "longitude": data['_longitude'],
+            "timestamp": data['_timestamp'],
+            "datetime": _normalize_timestamp(data['_timestamp']),
+            "accuracy": data['_accuracy'],
+            "address": data['_address'],
+            "country_code": data['_country_code'],
+            "charging": data['_charging'],
+            "battery_level": data['_battery_level'],
+        }
+        row["id"] = cls.hash_values(row[field] for field in cls._HASH_FIELDS)
+        return row
+
     def get_datetime(self):
         return datetime.fromisoformat(self.datetime)
 
+    def to_row(self) -> dict:
+        """Spaltenwerte als dict für Core-Inserts."""
+        return {column: getattr(self, column) for column in self.__table__.columns.keys()}
+
+    @staticmethod
+    def hash_values(values) -> str:
+        # Felder direkt in den Hash schreiben statt einen String zusammenzubauen.
+        # Trennzeichen nur zwischen den Werten, damit bestehende IDs gleich bleiben.
+        digest = hashlib.sha256()
+        update = digest.update
+        separator = b''
+        for value in values:
+            update(separator)
+            if value is not None:
+                update(str(value).encode('utf-8'))
+            separator = _HASH_SEPARATOR
+        return digest.hexdigest()
+
     def compute_hash(self) -> str:
-        keys = [
-            self.full_name, self.nickname, self.latitude, self.longitude,
-            self.timestamp, self.accuracy, self.address, self.country_code,
-            self.charging, self.battery_level
-        ]
-        values = [str(v) if v is not None else '' for v in keys]
-        combined = "|".join(values)
-        return hashlib.sha256(combined.encode('utf-8')).hexdigest()
+        return self.hash_values(getattr(self, field) for field in self._HASH_FIELDS)
 
 class ProximityModel(SQLModel, table=True):
     __tablename__ = "proximities"
@@ -85,7 +167,7 @@ class ProximityModel(SQLModel, table=True):
     )
 
     ts: datetime = Field(
-        ..., description="Mittelwert der beiden Zeitstempel"
+        ..., description="Mittelwert der beiden Zeitstempel", index=True
     )
 
 class ProximityNotification(SQLModel, table=True):
@@ -113,7 +195,7 @@ class ErrorMessageModel(SQLModel, table=True):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()), primary_key=True)  # UUID als ID
     error_code: int = Field(..., description="Error Code")
     error_message: str = Field(default=None)  # Standardmäßig None, wird in der Validierung gesetzt
-    timestamp: datetime = Field(default_factory=datetime.utcnow)
+    timestamp: datetime = Field(default_factory=datetime.utcnow, index=True)
     additional_info: Optional[str] = None
 
     def __init__(self, **data):
@@ -134,54 +216,106 @@ class LocationUpdater:
         # Datenbank einrichten (implemetiere setup_database nach Bedarf)
         self.engine = self.setup_database(self.config)
         self.push = self._initialize_push()
+        self.upload_workers = self.config.get('upload_workers', 16)
+        self.http = self._initialize_http()
+
+        # Insert-Statements einmal bauen; SQLAlchemy cached die kompilierte Form
+        self._person_insert = sqlite_insert(PersonModel).on_conflict_do_nothing(index_elements=['id'])
+        self._uploaded_insert = sqlite_insert(UploadedModel).on_conflict_do_nothing(index_elements=['id'])
+
         self._service = None
+        self._service_created_at = None
+        # Service (und dessen requests-Session) wird über CronJob-Ticks wiederverwendet
+        # und erst nach Ablauf dieser Zeit neu aufgebaut
+        self.service_ttl = self.config.get('service_ttl', 60*60)
 
         # Schwellenwerte aus der Konfiguration auslesen
         thresholds = self.config.get('thresholds', {})
         self.close_threshold = thresholds.get('close', 1000)
         self.far_threshold = thresholds.get('far', 1000)
 
+    @cached_property
+    def _phonetrack_prefix(self) -> str:
+        phonetrack = self.config['phonetrack']
+        return f"https://{phonetrack['host']}/apps/phonetrack/logGet/{phonetrack['key']}/"
+
     @property
     def service(self):
-        if self._service is None:
+        if self._service is None or time.monotonic() - self._service_created_at > self.service_ttl:
             self._service = self._initialize_service()
+            self._service_created_at = time.monotonic()
         return self._service
     
-    def check_proximities(self):
+    def _session(self, session: Optional[Session] = None):
+        """Übergebene Session weiterverwenden oder eine neue öffnen."""
+        return nullcontext(session) if session is not None else Session(self.engine)
+
+    def check_proximities(self, session: Optional[Session] = None):
         """
         Nutzt die beim Objekt gesetzten Thresholds für Nähe/Ferne.
         Führt Statusprüfung und ggf. Push durch.
         """
-        self.update_proximities()
-        self.load_proximities_with_status(
-            close_threshold=self.close_threshold,
-            far_threshold=self.far_threshold
-        )
+        # Eine Session für alle Proximity-Schritte dieses Durchlaufs
+        with self._session(session) as session:
+            self.update_proximities(session)
+            self.load_proximities_with_status(
+                close_threshold=self.close_threshold,
+                far_threshold=self.far_threshold,
+                session=session
+            )
 
-    def load_proximities_with_status(self, close_threshold=1000, far_threshold=1000):
-        with Session(self.engine) as session:
-            proximities = session.exec(select(ProximityModel)).all()
-    
-            # Personen-Vollnamen mappen
-            person_ids = set(p.person1_id for p in proximities) | set(p.person2_id for p in proximities)
-            persons = session.exec(select(PersonModel).where(PersonModel.id.in_(person_ids))).all()
-            person_map = {p.id: p.full_name for p in persons}
+    def load_proximities_with_status(self, close_threshold=1000, far_threshold=1000, session: Optional[Session] = None):
+        with self._session(session) as session:
+            # Je Namenspaar nur die letzten 4 Einträge aus SQLite holen (Window-Funktion)
+            person1 = aliased(PersonModel)
+            person2 = aliased(PersonModel)
+            name1 = func.coalesce(person1.full_name, "Unknown1")
+            name2 = func.coalesce(person2.full_name, "Unknown2")
+            pair_low = func.min(name1, name2)
+            pair_high = func.max(name1, name2)
+            ranked = (
+                select(
+                    pair_low.label("pair_low"),
+                    pair_high.label("pair_high"),
+                    ProximityModel.id,
+                    ProximityModel.ts,
+                    ProximityModel.spatial_distance,
+                    func.row_number().over(
+                        partition_by=(pair_low, pair_high),
+                        order_by=ProximityModel.ts.desc()
+                    ).label("recency"),
+                )
+                .outerjoin(person1, person1.id == ProximityModel.person1_id)
+                .outerjoin(person2, person2.id == ProximityModel.person2_id)
+                .subquery()
+            )
+            latest_proximities = session.exec(
+                select(*ranked.c)
+                .where(ranked.c.recency <= 4)
+                .order_by(ranked.c.pair_low, ranked.c.pair_high, ranked.c.ts)
+            ).all()
     
-            # Pärchen → Einträge gruppieren
+            # Pärchen → Einträge gruppieren (bereits nach ts aufsteigend sortiert)
             pair_history = defaultdict(list)
-            for p in proximities:
-                name1 = person_map.get(p.person1_id, "Unknown1")
-                name2 = person_map.get(p.person2_id, "Unknown2")
-                pair_key = frozenset([name1, name2])
+            for p in latest_proximities:
+                pair_key = frozenset([p.pair_low, p.pair_high])
                 pair_history[pair_key].append({
                     "ts": p.ts,
                     "distance": p.spatial_distance,
                     "id": p.id,
                 })
     
+            # Vorhandene Benachrichtigungen zu diesen Einträgen einmal laden statt pro Paar abzufragen
+            sent_notifications = {
+                (proximity_id, status) for proximity_id, status in session.exec(
+                    select(ProximityNotification.proximity_id, ProximityNotification.status)
+                    .where(ProximityNotification.proximity_id.in_([p.id for p in latest_proximities]))
+                )
+            }
+            new_notifications = []
+    
             result = []
-            for pair_key, records in pair_history.items():
-                sorted_records = sorted(records, key=lambda r: r["ts"])[-4:]  # Nur die letzten 4
+            for pair_key, sorted_records in pair_history.items():
                 status_list = []
                 for rec in sorted_records:
                     dist = rec["distance"]
@@ -205,14 +339,7 @@ class LocationUpdater:
                             last_type, last_ts, last_id = recent_statuses[-1]
     
                             # Vorher prüfen, ob Benachrichtigung schon existiert
-                            existing = session.exec(
-                                select(ProximityNotification).where(
-                                    ProximityNotification.proximity_id == last_id,
-                                    ProximityNotification.status == current_type
-                                )
-                            ).first()
-    
-                            if not existing:
+                            if (last_id, current_type) not in sent_notifications:
                                 # Push senden
                                 name1, name2 = sorted(pair_key)
                                 last_ts_utc = last_ts.replace(tzinfo=ZoneInfo("UTC"))
@@ -227,14 +354,13 @@ class LocationUpdater:
                                 )
                                 self.push.send(msg, priority=3)
     
-                                # Notification speichern
-                                notification = ProximityNotification(
+                                # Notification vormerken, gespeichert wird gesammelt am Ende
+                                new_notifications.append(ProximityNotification(
                                     proximity_id=last_id,
                                     status=current_type,
                                     timestamp=last_ts
-                                )
-                                session.add(notification)
-                                session.commit()
+                                ))
+                                sent_notifications.add((last_id, current_type))
     
                             status_change = current_type
     
@@ -243,63 +369,91 @@ class LocationUpdater:
                     "history": [(s, ts.isoformat()) for s, ts, _ in status_list],
                     "current_status": status_change
                 })
+
+            if new_notifications:
+                session.add_all(new_notifications)
+                session.commit()
     
         return result
 
 
-    def update_proximities(self):
+    def update_proximities(self, session: Optional[Session] = None):
         now = datetime.now(timezone.utc)
         time_threshold = now - timedelta(hours=1)
     
-        with Session(self.engine) as session:
+        with self._session(session) as session:
+            # Nur benötigte Spalten als Tupel lesen, ohne ORM-Objekte aufzubauen
             persons = session.exec(
-                select(PersonModel)
+                select(
+                    PersonModel.id,
+                    PersonModel.full_name,
+                    PersonModel.latitude,
+                    PersonModel.longitude,
+                    PersonModel.datetime
+                )
                 .where(PersonModel.datetime != None, PersonModel.datetime >= time_threshold)
             ).all()
     
+            # Letzte Position je Person als schlankes Tupel
             latest = {}
             for p in persons:
-                if p.full_name not in latest or p.get_datetime() > latest[p.full_name].get_datetime():
-                    latest[p.full_name] = p
-    
-            person_list = list(latest.values())
-    
-            for person1, person2 in combinations(person_list, 2):
-                dt1 = person1.get_datetime()
-                dt2 = person2.get_datetime()
-                time_diff = abs((dt1 - dt2).total_seconds())
-                if time_diff > 300:
-                    continue
+                position_ts = datetime.fromisoformat(p.datetime).timestamp()
+                if p.full_name not in latest or position_ts > latest[p.full_name].ts:
+                    latest[p.full_name] = _Location(p.id, p.latitude, p.longitude, position_ts)
     
-                distance = geodesic(
-                    (person1.latitude, person1.longitude),
-                    (person2.latitude, person2.longitude)
-                ).meters
+            locations = list(latest.values())
+
+            # Zeit- und Luftlinienabstände (Haversine) vektorisiert über alle Paare
+            lat = np.radians([loc.lat for loc in locations])
+            lon = np.radians([loc.lon for loc in locations])
+            ts = np.array([loc.ts for loc in locations])
+
+            # Paare (i < j) zuerst nach Zeitabstand filtern (höchstens 5 Minuten);
+            # die Trigonometrie läuft nur noch für die verbleibenden Paare
+            idx1, idx2 = np.triu_indices(len(locations), k=1)
+            time_diffs = np.abs(ts[idx1] - ts[idx2])
+            in_time = time_diffs <= 300
+            idx1, idx2, time_diffs = idx1[in_time], idx2[in_time], time_diffs[in_time]
+
+            dlat = lat[idx1] - lat[idx2]
+            dlon = lon[idx1] - lon[idx2]
+            a = np.sin(dlat / 2)**2 + np.cos(lat[idx1]) * np.cos(lat[idx2]) * np.sin(dlon / 2)**2
+            distances = 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+            # Bereits erfasste Paare einmal laden statt pro Paar abzufragen. Der Zeitstempel
+            # einer Proximity ist der Mittelwert zweier Positionen, die beide jünger als
+            # time_threshold sind, daher genügt dieser Ausschnitt.
+            existing_pairs = {
+                frozenset(pair) for pair in session.exec(
+                    select(ProximityModel.person1_id, ProximityModel.person2_id)
+                    .where(ProximityModel.ts >= time_threshold)
+                ).all()
+            }
+
+            new_proximities = []
+            for i, j, time_diff, distance in zip(
+                idx1.tolist(), idx2.tolist(), time_diffs.tolist(), distances.tolist()
+            ):
+                loc1, loc2 = locations[i], locations[j]
     
-                existing_proximity = session.exec(
-                    select(ProximityModel).where(
-                        ((ProximityModel.person1_id == person1.id) & 
-                         (ProximityModel.person2_id == person2.id)) |
-                        ((ProximityModel.person1_id == person2.id) & 
-                         (ProximityModel.person2_id == person1.id))
-                    )
-                ).first()
-    
-                if existing_proximity:
+                if frozenset((loc1.id, loc2.id)) in existing_pairs:
                     continue
     
-                # Mittelwert der beiden Zeitstempel berechnen
-                avg_datetime = dt1 + (dt2 - dt1) / 2
-    
-                proximity = ProximityModel(
-                    person1_id=person1.id,
-                    person2_id=person2.id,
-                    spatial_distance=distance,
-                    temporal_distance=time_diff,
-                    ts=avg_datetime
-                )
-                session.add(proximity)
+                # Mittelwert der beiden Zeitstempel; datetime nur für tatsächlich neue Einträge
+                avg_datetime = datetime.fromtimestamp((loc1.ts + loc2.ts) / 2, tz=timezone.utc)
     
+                new_proximities.append({
+                    "id": str(uuid.uuid4()),
+                    "person1_id": loc1.id,
+                    "person2_id": loc2.id,
+                    "spatial_distance": distance,
+                    "temporal_distance": time_diff,
+                    "ts": avg_datetime,
+                })
+
+            # Ein executemany statt Unit-of-Work mit einem ORM-Objekt pro Paar
+            if new_proximities:
+                session.execute(insert(ProximityModel), new_proximities)
             session.commit()
 
     def _initialize_push(self):
@@ -317,6 +471,21 @@ class LocationUpdater:
         except KeyError as e:
             raise ValueError(f"Missing configuration for PushNotify: {e}")
 
+    def _initialize_http(self):
+        # Gemeinsame Session, damit Verbindungen (inkl. TLS) wiederverwendet werden
+        session = requests.Session()
+        session.mount('https://', HTTPAdapter(
+            pool_connections=16,
+            pool_maxsize=self.upload_workers,
+            max_retries=Retry(
+                total=3,
+                backoff_factor=0.3,
+                status_forcelist=[429, 502, 503, 504],
+                allowed_methods=['GET']
+            )
+        ))
+        return session
+
     def _initialize_service(self):
         try:
             return Service(
@@ -330,8 +499,9 @@ class LocationUpdater:
             raise ValueError("Invalid Cookies")
 
     def load_config(self, path: str):
-        with open(path, 'r') as file:
-            return yaml.safe_load(file)
+        # Geparst wird nur, wenn sich die Datei seit dem letzten Laden geändert hat
+        path = os.path.abspath(path)
+        return _load_yaml(path, os.stat(path).st_mtime_ns)
         
     def add_error_code_to_db(self, error_code: int):
         """Fügt einen Fehlercode zur Datenbank hinzu."""
@@ -347,71 +517,108 @@ class LocationUpdater:
         time_threshold = datetime.now(UTC) - timedelta(seconds=seconds)
 
         with Session(self.engine) as session:
-            statement = select(ErrorMessageModel).where(ErrorMessageModel.timestamp >= time_threshold)
-            results = session.exec(statement).all()
-
-        return len(results) > 0 
+            # Für die Ja/Nein-Antwort reicht ein Treffer
+            statement = (
+                select(ErrorMessageModel.id)
+                .where(ErrorMessageModel.timestamp >= time_threshold)
+                .limit(1)
+            )
+            return session.exec(statement).first() is not None
 
     def setup_database(self, config):
         db_path = os.path.abspath(config.get('db_path', './data/data.db'))
+
+        # Engine (und create_all) nur einmal pro Prozess und Datenbankpfad
+        engine = _ENGINES.get(db_path)
+        if engine is not None:
+            return engine
+
+        # NORMAL ist mit WAL sicher gegen Abstürze; OFF ist schneller, riskiert aber
+        # bei Stromausfall die letzten Commits (z. B. auf SD-Karten)
+        synchronous = str(config.get('sqlite_synchronous', 'NORMAL')).upper()
+        if synchronous not in {"OFF", "NORMAL", "FULL", "EXTRA"}:
+            raise ValueError(f"Ungültiger Wert für sqlite_synchronous: {synchronous}")
+
         os.makedirs(os.path.dirname(db_path), exist_ok=True)
         database_url = f"sqlite:///{db_path}"
         engine = create_engine(database_url)
+
+        @event.listens_for(engine, "connect")
+        def _set_sqlite_pragmas(dbapi_connection, connection_record):
+            # WAL erlaubt Lesen während geschrieben wird und spart den fsync pro Commit
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute(f"PRAGMA synchronous={synchronous}")
+            cursor.execute("PRAGMA temp_store=MEMORY")
+            cursor.execute("PRAGMA mmap_size=268435456")
+            cursor.execute("PRAGMA cache_size=-65536")
+            cursor.close()
+
         SQLModel.metadata.create_all(engine, checkfirst=True)
+
+        # create_all legt Indizes nur mit neuen Tabellen an; bei bestehenden Datenbanken nachziehen
+        with engine.begin() as conn:
+            for table in SQLModel.metadata.sorted_tables:
+                for index in table.indexes:
+                    index.create(conn, checkfirst=True)
+        _ENGINES[db_path] = engine
         return engine
 
+    def build_person(self, person_data) -> PersonModel:
+        return PersonModel.from_person_gpx(person_data)
+
     def create_person(self, person_data):
-        person = PersonModel(
-            full_name=person_data['_full_name'],
-            nickname=person_data['_nickname'],
-            latitude=person_data['_latitude'],
-            longitude=person_data['_longitude'],
-            timestamp=person_data['_timestamp'],
-            datetime=person_data['_timestamp'],
-            accuracy=person_data['_accuracy'],
-            address=person_data['_address'],
-            country_code=person_data['_country_code'],
-            charging=person_data['_charging'],
-            battery_level=person_data['_battery_level']
-        )
+        person = self.build_person(person_data)
 
-        with Session(self.engine) as session:
-            existing = session.get(PersonModel, person.id)
-            if existing:
-                return existing
-            session.add(person)
-            session.commit()
-            session.refresh(person)
-            return person
+        # Primärschlüssel übernimmt die Deduplizierung, kein vorheriges SELECT nötig
+        with self.engine.begin() as conn:
+            conn.execute(self._person_insert, person.to_row())
+        return person
 
     def create_uploaded(self, person: PersonModel):
-        with Session(self.engine) as session:
-            result = session.get(UploadedModel, person.id)
-            if result:
-                return result
-            uploaded = UploadedModel(id=person.id)
-            session.add(uploaded)
-            session.commit()
-            session.refresh(uploaded)
-            return uploaded
+        uploaded = UploadedModel(id=person.id)
+
+        # Eine vorhandene Markierung bleibt bestehen, kein vorheriges SELECT nötig
+        with self.engine.begin() as conn:
+            conn.execute(
+                self._uploaded_insert,
+                {"id": uploaded.id, "upload_datetime": uploaded.upload_datetime}
+            )
+        return uploaded
 
     def update_database(self):
-        for person_gpx in self.service.get_all_people():
-            self.create_person(person_gpx.__dict__)
+        # Funktioniert für Listen wie Generatoren; es liegen höchstens 1000 Zeilen im Speicher
+        people = iter(self.service.get_all_people())
+
+        # Eine Transaktion für den ganzen Durchlauf, geschrieben in Blöcken von 1000 Zeilen
+        with self.engine.begin() as conn:
+            while chunk := list(islice(people, 1000)):
+                conn.execute(
+                    self._person_insert,
+                    [PersonModel.row_from_person_gpx(person_gpx.__dict__) for person_gpx in chunk]
+                )
 
-    def update_position(self, person: PersonModel) -> Optional[str]:
-        phonetrack = self.config['phonetrack']
-        session_name = quote(person.full_name)
-        url = (
-            f"https://{phonetrack['host']}/apps/phonetrack/logGet/{phonetrack['key']}/{session_name}?"
-            f"lat={person.latitude}&lon={person.longitude}&alt=0&acc={person.accuracy or 0}"
-            f"&bat={person.battery_level or 0}&sat=0&speed=0&bearing=0&timestamp={person.timestamp}"
-        )
+    def update_position(self, person) -> Optional[str]:
+        """
+        Sendet eine Position an Phonetrack. person ist eine Zeile mit den Attributen
+        full_name, latitude, longitude, timestamp, accuracy und battery_level.
+        """
+        query = urlencode({
+            "lat": person.latitude,
+            "lon": person.longitude,
+            "alt": 0,
+            "acc": person.accuracy or 0,
+            "bat": person.battery_level or 0,
+            "sat": 0,
+            "speed": 0,
+            "bearing": 0,
+            "timestamp": person.timestamp,
+        })
+        url = f"{self._phonetrack_prefix}{_quote_name(person.full_name)}?{query}"
 
         try:
-            response = requests.get(url)
+            response = self.http.get(url, timeout=(3, 10))
             response.raise_for_status()
-            self.create_uploaded(person)
             return response.text
         except requests.exceptions.RequestException as e:
             print(f"Fehler beim Senden der Anfrage: {e}")
@@ -419,22 +626,52 @@ class LocationUpdater:
 
     def ensure_all_positions_uploaded(self):
         with Session(self.engine) as session:
-            all_persons = session.exec(select(PersonModel)).all()
-            uploaded_ids = set(session.exec(select(UploadedModel.id)).all())
-            not_uploaded = [p for p in all_persons if p.id not in uploaded_ids]
-
-            results = []
-            for person in not_uploaded:
-                result = self.update_position(person)
-                results.append((person.id, result))
-            return results
-        
+            # Anti-Join in SQL statt beide Tabellen in Python abzugleichen;
+            # nur die für den Upload nötigen Spalten, als Tupel gestreamt
+            not_uploaded = session.exec(
+                select(
+                    PersonModel.id,
+                    PersonModel.full_name,
+                    PersonModel.latitude,
+                    PersonModel.longitude,
+                    PersonModel.timestamp,
+                    PersonModel.accuracy,
+                    PersonModel.battery_level
+                )
+                .outerjoin(UploadedModel, PersonModel.id == UploadedModel.id)
+                .where(UploadedModel.id == None)
+                .execution_options(yield_per=500)
+            )
+
+            # Uploads parallel senden; die Datenbank wird nur im Hauptthread beschrieben
+            with ThreadPoolExecutor(max_workers=self.upload_workers) as executor:
+                futures = [
+                    (person.id, executor.submit(self.update_position, person))
+                    for person in not_uploaded
+                ]
+                results = [(person_id, future.result()) for person_id, future in futures]
+
+        # Erfolgreiche Uploads gesammelt in einer Transaktion vermerken
+        successful = [person_id for person_id, result in results if result is not None]
+        if successful:
+            uploaded_at = datetime.utcnow()
+            with self.engine.begin() as conn:
+                conn.execute(
+                    self._uploaded_insert,
+                    [{"id": person_id, "upload_datetime": uploaded_at} for person_id in successful]
+                )
+        return results
+
     def run(self):
         self.update_database()
         self.ensure_all_positions_uploaded()
         self.check_proximities()
         
 class CronJob(threading.Thread):
+    """
+    Führt target_function periodisch in einem eigenen Thread aus.
+    Weitere Jobs können vor start() mit add_job im selben Thread eingeplant werden.
+    """
     def __init__(self, interval_seconds, target_function, *args, **kwargs):
         super().__init__()
         self.interval = interval_seconds
@@ -442,18 +679,35 @@ class CronJob(threading.Thread):
         self.args = args
         self.kwargs = kwargs
         self._stop_event = threading.Event()
+        # Monotone Uhr: kein Drift, keine Sprünge durch NTP
+        self._scheduler = sched.scheduler(time.monotonic, self._wait)
+        self.add_job(interval_seconds, target_function, *args, **kwargs)
+
+    def add_job(self, interval_seconds, target_function, *args, **kwargs):
+        self._schedule(time.monotonic(), interval_seconds, target_function, args, kwargs)
+
+    def _schedule(self, deadline, interval, target_function, args, kwargs):
+        self._scheduler.enterabs(
+            deadline, 0, self._run_job, (deadline, interval, target_function, args, kwargs)
+        )
+
+    def _run_job(self, deadline, interval, target_function, args, kwargs):
+        try:
+            target_function(*args, **kwargs)
+        except Exception as e:
+            print(f"Fehler beim Ausführen der Funktion: {e}")
+        # Fester Takt ab Start; bei Überlauf sofort weiter und ab jetzt neu takten
+        next_run = max(deadline + interval, time.monotonic())
+        self._schedule(next_run, interval, target_function, args, kwargs)
+
+    def _wait(self, timeout):
+        # stop() weckt sofort auf; dann alle ausstehenden Jobs verwerfen, damit run() endet
+        if self._stop_event.wait(timeout):
+            for pending in self._scheduler.queue:
+                self._scheduler.cancel(pending)
 
     def run(self):
-        while not self._stop_event.is_set():
-            start_time = time.time()
-            try:
-                self.target_function(*self.args, **self.kwargs)
-            except Exception as e:
-                print(f"Fehler beim Ausführen der Funktion: {e}")
-            elapsed = time.time() - start_time
-            time_to_wait = self.interval - elapsed
-            if time_to_wait > 0:
-                self._stop_event.wait(time_to_wait)
+        self._scheduler.run()
 
     def stop(self):
         self._stop_event.set()
@@ -473,13 +727,19 @@ class PushNotify:
                             "title": 'GMAPS',
                         }
         self.payload.update(kwargs)
+        # Verbindung zum Gotify-Server über mehrere Nachrichten hinweg wiederverwenden
+        self._session = requests.Session()
         
     def send(self, message, **kwargs):
         url = f"{self.host}/message?token={self.token}"
         payload = self.payload.copy()
         payload.update(kwargs)
         payload['message'] = message
-        response = requests.post(url, json=payload)
+        try:
+            response = self._session.post(url, json=payload, timeout=(3, 5))
+        except requests.exceptions.RequestException as e:
+            print(f"Fehler beim Senden der Push-Nachricht: {e}")
+            return False
         return response.status_code == 200
 
 if __name__ == "__main__":